@@ -1,16 +1,19 @@
 import argparse
+import bisect
+import contextlib
+import itertools
 import os
 import random
 
 
 def main():
     args = parse_args()
-    dataset = load_dataset(args.source_data, args.target_data)
     vocabulary = load_vocabulary(args.vocabulary)
-    bins = assign_to_bins(dataset, vocabulary, args.threshold, args.side, args.averaged)
+    dataset = iter_pairs(args.source_data, args.target_data)
+    counts, samples = assign_to_bins(dataset, vocabulary, args.thresholds, args.side, args.averaged, args.out_dir)
 
-    write_to_files(bins, args.out_dir)
-    print_stats(bins)
+    print("\nFiles written to: {}".format(args.out_dir))
+    print_stats(counts, samples, args.thresholds)
    
 
 def parse_args():
@@ -29,26 +32,38 @@ def parse_args():
     if args.threshold == None:
         raise ValueError("No thresholds given. Provide at least one threshold for sorting")
     else:
+        # sort once, all later steps rely on ascending thresholds
+        args.thresholds = tuple(sorted(set(args.threshold)))
         return args
 
 
-def load_dataset(source_path, target_path):
-    """Read parallel data from file (includes tokenization)
+def iter_pairs(source_path, target_path):
+    """Stream parallel data from file
+
+    Both files are read line by line, so the corpus is never held
+    in memory as a whole. Lines are kept as raw strings (newline
+    terminated), tokenization is left to the ranking. Pairs with a
+    blank line on either side are skipped
 
     Arguments:
             source_path {str} -- path to source language text file
             target_path {str} -- path to target language text file
 
-    Returns:
-            list -- list containing tuples of sentence pairs (tokenized)
+    Yields:
+            tuple -- sentence pair (raw lines)
     """
-    with open(source_path) as source_file:
-        lines_source = [line.split() for line in source_file.readlines()]
+    with open(source_path) as source_file, open(target_path) as target_file:
+        for line_source, line_target in zip(source_file, target_file):
+            if line_source.isspace() or line_target.isspace():
+                continue
 
-    with open(target_path) as target_file:
-        lines_target = [line.split() for line in target_file.readlines()]
+            # last line of a file may lack the newline
+            if not line_source.endswith("\n"):
+                line_source += "\n"
+            if not line_target.endswith("\n"):
+                line_target += "\n"
 
-    return list(zip(lines_source, lines_target))
+            yield line_source, line_target
 
 
 def load_vocabulary(path):
@@ -56,68 +71,104 @@ def load_vocabulary(path):
 
     Vocab file must be of format: 
     word tab frequency
+    (at least these two tab separated columns per line,
+    further columns are ignored)
 
     Arguments:
             path {str} -- path to vocabulary file
 
     Returns:
-            dict -- key: word, value: frequency
+            dict -- key: word, value: frequency (most frequent words first)
     """
     vocab_dict = dict()
     with open(path) as vocab_file:
-        lines = vocab_file.readlines()[1:]  # skip column headers
+        next(vocab_file)  # skip column headers
 
-        for line in lines:
-            splitted = line.split("\t")
-            vocab_dict[splitted[0]] = int(
-                splitted[1].strip("\n"))
+        for line in vocab_file:
+            # split off at most the first two columns
+            splitted = line.split("\t", 2)
+            vocab_dict[splitted[0]] = int(splitted[1])
 
-    return vocab_dict
+    # re-insert words by descending frequency: dict entries are stored in
+    # insertion order, so the most frequent (most looked up) words end up
+    # next to each other in memory
+    return dict(sorted(vocab_dict.items(), key=lambda item: item[1], reverse=True))
 
 
-def assign_to_bins(dataset, vocabulary, thresholds, side, averaged):
-    """Assign data to bins of different difficulty
+def assign_to_bins(dataset, vocabulary, thresholds, side, averaged, out_dir):
+    """Assign data to bins of different difficulty and write them to files
 
     A sentence qualifies for a specific bin, if it's rank  
     exceeds the according threshold
 
-    Example:
-    bins[100] contains all sentences with rank > 100,
-    bins[10] contains all sentences with 100 > rank > 10
+    Example (thresholds == (10, 100)):
+    bin 1 contains all sentences with rank > 100,
+    bin 0 contains all sentences with 100 > rank > 10
+
+    Sent-pairs are written to the files of their bin right away, so
+    bins are never held in memory. Files are only created for bins
+    that get at least one sent-pair. Per bin, only the number of
+    sent-pairs and one randomly sampled target sentence are kept.
 
     Arguments:
-            dataset {list} -- list of tuples of tokenized sent-pairs
+            dataset {iterable} -- tuples of sent-pairs (raw lines)
             vocabulary {dict} -- dict with word:freq
-            thresholds {list} -- the values needed to qualify a sent for an according bin
+            thresholds {tuple} -- the values needed to qualify a sent for an according bin (ascending)
             side {str} -- "source" or "target": side of corpus to base sorting on  
             averaged{bool} -- whether to use averaged word frequencies
+            out_dir {str} -- path to output directory
 
     Returns:
-            dict -- key: bin-threshold, val: list containing all qualified sent-pairs
+            tuple -- per threshold: number of sent-pairs (list),
+                     sample target sentence or None (list)
     """
-    bins = {t: [] for t in thresholds}
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    counts = [0] * len(thresholds)
+    samples = [None] * len(thresholds)
+    bin_writers = [None] * len(thresholds)
 
     if side == "source":
         idx = 0
     elif side == "target":
         idx = 1
 
-    for sent_pair in dataset:
-        sent_rank = rank_sentence(sent_pair[idx], vocabulary, averaged)
+    # bind functions used in the loop to locals to skip global lookups
+    rank = rank_sentence
+    find_bin = bisect.bisect_right
+    rand = random.random
+
+    with contextlib.ExitStack() as stack:
+        for sent_pair in dataset:
+            # only the side used for sorting needs to be tokenized
+            sent_rank = rank(sent_pair[idx].split(), vocabulary, averaged)
+
+            # thresholds are ascending, so the bin of a sentence
+            # can be found by binary search
+            bin_idx = find_bin(thresholds, sent_rank) - 1
+            if bin_idx < 0:
+                continue
+
+            writers = bin_writers[bin_idx]
+            if writers is None:
+                outfile_source, outfile_target = open_bin_files(stack, out_dir, thresholds[bin_idx])
+                writers = bin_writers[bin_idx] = (outfile_source.write, outfile_target.write)
+
+            writers[0](sent_pair[0])
+            writers[1](sent_pair[1])
 
-        for threshold in sorted(bins.keys(), reverse=True):
-            if sent_rank >= threshold:
-                bins[threshold].append(sent_pair)
-                break
+            # reservoir sampling: the n-th sent-pair of a bin
+            # becomes its sample with probability 1/n
+            counts[bin_idx] += 1
+            if rand() * counts[bin_idx] < 1:
+                samples[bin_idx] = sent_pair[1]
 
-    # remove empty bins
-    keys = list(bins.keys())
-    for key in keys:
-        if bins[key] == []:
-            print("Bin with threshold {} is empty.".format(key))
-            del bins[key]
+    for threshold, count in zip(thresholds, counts):
+        if count == 0:
+            print("Bin with threshold {} is empty.".format(threshold))
 
-    return bins
+    return counts, samples
 
 
 def rank_sentence(sentence, vocabulary, averaged):
@@ -135,13 +186,8 @@ def rank_sentence(sentence, vocabulary, averaged):
     Returns:
             number -- the rank of a sentence
     """
-    frequencies = []
-
-    for word in sentence:
-        try:
-            frequencies.append(vocabulary[word])
-        except KeyError:
-            frequencies.append(0)
+    # look up all words at C level (map + dict.get), unknown words count as 0
+    frequencies = map(vocabulary.get, sentence, itertools.repeat(0))
 
     if averaged:
         summed_freqs = sum(frequencies)
@@ -150,47 +196,32 @@ def rank_sentence(sentence, vocabulary, averaged):
         return min(frequencies)
 
 
-def write_to_files(bins, out_dir):
-    """Writes sorted data to files
-
-    Each bin is written to a seperate file
+def open_bin_files(stack, out_dir, threshold):
+    """Open the source and target output files of a bin
 
     Arguments:
-            bins {dict} -- threshold:[sent-pairs]
+            stack {contextlib.ExitStack} -- closes the files when done
             out_dir {str} -- path to output directory
-    """
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
+            threshold {int} -- threshold of the bin
 
-    for key in bins.keys():
-        outfile_source = open("{}/src_{}.txt".format(out_dir, key), "w")
-        outfile_target = open("{}/trg_{}.txt".format(out_dir, key), "w")
-
-        for sent in bins[key]:
-            outfile_source.write(" ".join(sent[0]))
-            outfile_source.write("\n")
-
-            outfile_target.write(" ".join(sent[1]))
-            outfile_target.write("\n")
-
-        outfile_source.close()
-        outfile_target.close()
+    Returns:
+            tuple -- source and target file objects
+    """
+    outfile_source = stack.enter_context(open("{}/src_{}.txt".format(out_dir, threshold), "w"))
+    outfile_target = stack.enter_context(open("{}/trg_{}.txt".format(out_dir, threshold), "w"))
 
-    print("\nFiles written to: {}".format(out_dir))
+    return outfile_source, outfile_target
 
 
-def print_stats(bins):
-    """Prints several stats and sample sentences for each bin"""
-    bins_keys = sorted(bins.keys(), reverse=True)
-    print("\nNumber of curriculum levels (bins) created: {}".format(len(bins_keys)))
-    print("Thresholds (min/average word frequencies): {}".format(bins_keys))
-    print("Data points per bin: {}\n".format([len(bins[b]) for b in bins]))
+def print_stats(counts, samples, thresholds):
+    """Prints several stats and sample sentences for each (non-empty) bin"""
+    levels = [(t, c, s) for t, c, s in zip(reversed(thresholds), reversed(counts), reversed(samples)) if c]
+    print("\nNumber of curriculum levels (bins) created: {}".format(len(levels)))
+    print("Thresholds (min/average word frequencies): {}".format([t for t, _, _ in levels]))
+    print("Data points per bin: {}\n".format([c for _, c, _ in levels]))
 
-    for key in bins_keys:
-        current_bin = bins[key]
-        random_idx = random.randint(0, len(current_bin))
-        sample_sent = " ".join(current_bin[random_idx][1])
-        print("Example bin (threshold {}):\n{}\n".format(key, sample_sent))
+    for threshold, _, sample in levels:
+        print("Example bin (threshold {}):\n{}\n".format(threshold, sample.strip()))
 
 
 if __name__ == '__main__':